@@ -1,29 +1,37 @@
 from moosedetector.thermalcamera import ThermalCamera
 from moosedetector.pipeline import FramePipeline
-from time import sleep
+from moosedetector.config import MooseDetectorConfig
 
 def main():
     """Main entry point for the Moose Detector application."""
 
     print("Starting Moose Detector...")
 
+    config = MooseDetectorConfig()
+
     # Create the frame processing pipeline.
-    pipeline = FramePipeline()
-
-    def handle_frame(frame):
-        # Intermediate callback function that handles incoming frames.
-        pipeline.process(frame)
- 
-    # Create and start the thermal camera with the frame callback.
-    camera = ThermalCamera(handle_frame)
+    pipeline = FramePipeline(config)
+
+    # Create and start the thermal camera. Frames are handed to the pipeline on the
+    # SDK thread and picked up for inference here on the main thread.
+    camera = ThermalCamera(pipeline.update)
     camera.start()
 
     try:
         while True:
-            sleep(1.0)
+            # img is None on timeout; process() still runs so a partial batch can flush.
+            img = pipeline.get_latest(timeout=1.0)
+            pipeline.process(img)
     except KeyboardInterrupt:
         print("\nShutting down...")
+    finally:
+        # Always release the camera, even if processing raised; skipping camera.stop()
+        # leaves the Seek manager alive and causes communication errors on the next run.
         camera.stop()
+        pipeline.close()
+        stats = pipeline.get_stats()
+        print(f"Frames received: {stats['frames_received']}, dropped: {stats['frames_dropped']}, "
+              f"skipped: {stats['frames_skipped']}")
 
 
 if __name__ == "__main__":
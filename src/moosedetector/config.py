@@ -0,0 +1,51 @@
+# Runtime settings for the Moose Detector. Defaults match the Raspberry Pi deployment.
+
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+MODELS_DIR = Path(__file__).resolve().parents[2] / "models"
+
+
+@dataclass
+class DetectionConfig:
+    model_path: Path = MODELS_DIR / "yolo26_best_v1.pt"
+    # Runtime the weights are exported to once and then loaded from. NCNN is the fastest
+    # CPU runtime on the Pi 5; "engine" (TensorRT) needs an NVIDIA GPU. None runs the
+    # PyTorch weights directly.
+    export_format: Optional[str] = "ncnn"
+    precision: str = "fp16"  # "fp32", "fp16" or "int8"
+    # Dataset YAML of captured thermal frames used to calibrate INT8 exports. INT8 is
+    # supported by the "engine" and "openvino" formats, not NCNN.
+    calibration_data: Optional[str] = None
+    # Inference input (height, width), fixed so preprocessing is a constant pad rather
+    # than a per-frame letterbox computation. Seek's 320x240 sensor rounded up to stride 32.
+    imgsz: tuple[int, int] = (256, 320)
+    # Skip inference on frames that barely differ from a running background of recent
+    # frames. Seek's AGC stretches every frame over the full palette, so pixel values
+    # say nothing about absolute heat, but a moving animal still changes the image.
+    # motion_threshold is the fraction of pixels that must change by more than
+    # motion_pixel_delta (0-255) for a frame to count as active. None disables it.
+    motion_threshold: Optional[float] = None
+    motion_pixel_delta: int = 25
+    # Quiet frames still get inference at least this often so nothing is missed for long.
+    max_skipped_frames: int = 9
+    # Frames per inference call. Batching raises throughput but every extra frame
+    # adds one camera period (~110 ms at 9 FPS) of latency, so keep this <= 4.
+    # ultralytics' NCNN backend runs one image per call, so NCNN always uses 1.
+    batch_size: int = 1
+    # Longest a partial batch waits for more frames before it is run anyway (seconds).
+    # None waits just long enough for a full batch at camera_fps.
+    batch_max_wait: Optional[float] = None
+    camera_fps: float = 9.0
+
+
+@dataclass
+class MooseDetectorConfig:
+    detection: DetectionConfig = field(default_factory=DetectionConfig)
+    # Skip all drawing and display work. Defaults to on when no display server is
+    # reachable, which is the normal case for field deployments.
+    headless: bool = field(
+        default_factory=lambda: not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+    )
@@ -3,41 +3,361 @@
 import numpy as np 
 from ultralytics import YOLO
 import cv2
+import torch
+import queue
+import shutil
+import threading
+import time
+
+WINDOW_NAME = "YOLO Detection"
+BOX_COLOR = (0, 255, 0)
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+# Weight of each new frame in the motion filter's running background.
+BACKGROUND_ALPHA = 0.05
+
+# Name suffix ultralytics gives each export format's artifact. The loader picks the
+# backend from it, so exported models must keep it when renamed.
+EXPORT_SUFFIXES = {
+    "ncnn": "_ncnn_model",
+    "onnx": ".onnx",
+    "openvino": "_openvino_model",
+    "engine": ".engine",
+}
+
+def _acquire(pool, shape):
+    # Reuse a buffer from the pool if one of the right shape is free, else allocate.
+    try:
+        buf = pool.get_nowait()
+    except queue.Empty:
+        return np.empty(shape, dtype=np.uint8)
+    if buf.shape != shape:
+        # Resolution changed; let the old buffer go.
+        return np.empty(shape, dtype=np.uint8)
+    return buf
+
+def _put_latest(slot, pool, item):
+    # Publish item to a single-slot queue, replacing (and recycling) any item the
+    # consumer hasn't taken yet. Each slot has one producer, so after draining it
+    # the second put cannot fail. Returns True if an item was dropped.
+    try:
+        slot.put_nowait(item)
+        return False
+    except queue.Full:
+        pass
+    try:
+        pool.put(slot.get_nowait())
+        dropped = True
+    except queue.Empty:
+        dropped = False
+    slot.put_nowait(item)
+    return dropped
+
+def _failed_marker(exported_path):
+    # Written next to an artifact whose export failed, so startup doesn't retry it.
+    return exported_path.with_name(exported_path.name + ".failed")
 
 class FramePipeline:
-    def __init__(self):
-        self._frame_count = 0
-        self.model = YOLO("/home/moose/projects/MooseDetector/models/yolo26_best_v1.pt")
+    def __init__(self, config):
+        self.config = config
+        self._frames_received = 0
+        self._frames_dropped = 0
+        self._frames_skipped = 0
+        self._quiet_streak = 0
+        # Running background for the motion filter: quarter-scale grayscale, float32.
+        self._background = None
+
+        detection = config.detection
+        self._batch_size = detection.batch_size
+        if detection.export_format == "ncnn" and self._batch_size > 1:
+            # ultralytics' NCNN backend only runs the first image of a batch.
+            print(f"NCNN runs one image per call, ignoring batch_size={self._batch_size}")
+            self._batch_size = 1
+        self._batch_max_wait = detection.batch_max_wait
+        if self._batch_max_wait is None:
+            # Enough time for the rest of the batch to arrive, plus half a camera period.
+            self._batch_max_wait = (self._batch_size - 0.5) / detection.camera_fps
+
+        # Set by _load_model. Exported runtimes take a fixed batch, so partial batches
+        # have to be padded for them; the PyTorch weights take any batch.
+        self._fixed_batch = False
+        self.model = self._load_model()
+        # Class names indexed by class id, so a frame's labels are one array lookup.
+        self._names = np.array([self.model.names[i] for i in range(len(self.model.names))])
+
+        # Run dummy inferences so runtime setup and kernel selection happen now rather than
+        # on the first real frames. Exports have a fixed batch, so use the full batch. The
+        # second pass is still slower than steady state on some runtimes, hence two.
+        height, width = detection.imgsz
+        dummy = np.zeros((height, width, 3), dtype=np.uint8)
+        for _ in range(2):
+            self.model([dummy] * self._batch_size, imgsz=detection.imgsz, verbose=False)
+
+        # Camera -> processing handoff. update() converts each frame into a pooled buffer
+        # and publishes it here; only the newest frame is kept, so a slow model drops
+        # frames instead of building up latency. _pending collects frames for a batch,
+        # which runs once full or at _batch_deadline, whichever comes first.
+        self._frame_queue = queue.Queue(maxsize=1)
+        self._frame_pool = queue.SimpleQueue()
+        self._pending = []
+        self._batch_deadline = 0.0
+
+        # imshow/waitKey run on their own thread so a slow display never stalls inference.
+        # The single-slot queue always holds the newest annotated frame. Frames are drawn
+        # on in place and only return to _frame_pool once shown (or dropped), so a buffer
+        # is never overwritten while on screen.
+        self._display_queue = queue.Queue(maxsize=1)
+        self._display_thread = None
+        if not config.headless:
+            self._display_thread = threading.Thread(target=self._display_loop, daemon=True)
+            self._display_thread.start()
+
+    def _load_model(self):
+        detection = self.config.detection
+        if detection.export_format is None:
+            return YOLO(detection.model_path)
+
+        # Export once and keep the artifact next to the weights; later runs load it directly.
+        # INT8 needs calibration data, so fall back to FP16 and then to the PyTorch weights.
+        precisions = [detection.precision]
+        if detection.precision == "int8":
+            precisions.append("fp16")
+
+        # Any artifact already on disk beats a fresh export, which can take minutes.
+        candidates = [(precision, self._exported_path(precision)) for precision in precisions]
+        for precision, exported_path in candidates:
+            if exported_path.exists():
+                self._fixed_batch = True
+                return YOLO(exported_path, task="detect")
+        for precision, exported_path in candidates:
+            if self._can_export(precision, exported_path) and self._export(precision, exported_path):
+                self._fixed_batch = True
+                return YOLO(exported_path, task="detect")
+
+        print(f"No exported model available, running {detection.model_path.name} directly")
+        return YOLO(detection.model_path)
+
+    def _exported_path(self, precision):
+        # The input and batch size are baked into the export, so they are part of the name.
+        detection = self.config.detection
+        suffix = EXPORT_SUFFIXES[detection.export_format]
+        weights = detection.model_path
+        height, width = detection.imgsz
+        return weights.with_name(
+            f"{weights.stem}_{height}x{width}_b{self._batch_size}_{precision}{suffix}"
+        )
+
+    def _can_export(self, precision, exported_path):
+        detection = self.config.detection
+        failed_marker = _failed_marker(exported_path)
+        if failed_marker.exists():
+            # Don't repeat a failed (and possibly slow) export on every startup.
+            print(f"Export to {exported_path.name} failed before, delete {failed_marker.name} to retry")
+            return False
+        if precision == "int8" and detection.calibration_data is None:
+            print("INT8 export needs calibration_data, skipping")
+            return False
+        if detection.export_format == "engine":
+            if not torch.cuda.is_available():
+                print("TensorRT export needs a CUDA GPU, skipping")
+                return False
+            # GPUs older than Volta (compute capability 7.0) have no fast FP16 path, so a
+            # TensorRT FP16 engine would be slower there.
+            if precision == "fp16" and torch.cuda.get_device_capability() < (7, 0):
+                print("GPU has no native FP16 support, skipping FP16 engine")
+                return False
+        return True
+
+    def _export(self, precision, exported_path):
+        detection = self.config.detection
+        weights = detection.model_path
+        print(f"Exporting {weights.name} to {detection.export_format} ({precision})...")
+        try:
+            exported = YOLO(weights).export(
+                format=detection.export_format,
+                half=precision == "fp16",
+                int8=precision == "int8",
+                data=detection.calibration_data if precision == "int8" else None,
+                imgsz=detection.imgsz,
+                batch=self._batch_size,
+            )
+        except (ImportError, OSError) as e:
+            # Installing the runtime or downloading the converter failed, usually for lack
+            # of network. That can clear up, so try again on the next start.
+            print(f"Export to {detection.export_format} ({precision}) failed, will retry next start: {e}")
+            return False
+        except Exception as e:
+            # Anything else (unsupported arguments, a bad calibration YAML, ...) will fail
+            # the same way next time, so record it rather than repeat a slow export.
+            print(f"Export to {detection.export_format} ({precision}) failed: {e}")
+            _failed_marker(exported_path).write_text(f"{e}\n")
+            return False
+        shutil.move(exported, exported_path)
+        return True
+
+    def update(self, frame):
+        # Called on the SDK callback thread. frame.data is only valid during the callback,
+        # so it is converted into a buffer we own before being handed over.
+        self._frames_received += 1
+
+        # The SDK's ARGB8888 pixels are laid out B, G, R, A in memory. Drop alpha in a
+        # single vectorized pass; BGR is what both YOLO and cv2.imshow expect for ndarrays.
+        img = _acquire(self._frame_pool, frame.data.shape[:2] + (3,))
+        cv2.cvtColor(frame.data, cv2.COLOR_BGRA2BGR, dst=img)
 
-    def process(self, frame):
-        self._frame_count += 1
+        if self._frames_received == 1:
+            # Log the first frame so the channel layout can be checked against the SDK.
+            print(f"First frame: shape={frame.data.shape}, pixel[0, 0]={frame.data[0, 0]}")
 
-        img = np.array(frame.data)
-        # Convert ARGB -> RGB
-        img_rgb = img[:, :, 1:4]
+        if _put_latest(self._frame_queue, self._frame_pool, img):
+            self._frames_dropped += 1
 
-        # Run YOLO inference 
-        results = self.model(img_rgb)
+    def get_latest(self, timeout=None):
+        # Wait for the newest converted frame. Returns None if none arrives in time. The
+        # wait is cut short when a partial batch is due, so process() can flush it.
+        if self._pending:
+            remaining = max(self._batch_deadline - time.monotonic(), 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return self._frame_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_stats(self):
+        # Plain int reads; the GIL keeps them consistent enough for reporting.
+        return {
+            "frames_received": self._frames_received,
+            "frames_dropped": self._frames_dropped,
+            "frames_skipped": self._frames_skipped,
+        }
+
+    def _is_quiet(self, img):
+        # Cheap pre-filter: a scene that matches its recent background has nothing new in
+        # it worth running the model on. Quarter scale is plenty to see an animal move.
+        detection = self.config.detection
+        if detection.motion_threshold is None:
+            return False
+        height, width = img.shape[:2]
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (width // 4, height // 4), interpolation=cv2.INTER_AREA)
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            self._quiet_streak = 0
+            return False
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+        changed = np.count_nonzero(diff > detection.motion_pixel_delta)
+        cv2.accumulateWeighted(small, self._background, BACKGROUND_ALPHA)
+
+        active = changed >= detection.motion_threshold * small.size
+        if active or self._quiet_streak >= detection.max_skipped_frames:
+            self._quiet_streak = 0
+            return False
+        self._quiet_streak += 1
+        self._frames_skipped += 1
+        return True
+
+    def process(self, img):
+        # img may be None when get_latest timed out; that still flushes an overdue batch.
+        if img is not None and self._is_quiet(img):
+            # Keep the display live, but don't spend inference on the frame. While older
+            # frames wait in a batch, showing this one would make the display jump back
+            # when the batch flushes, so it is only recycled then.
+            if self._pending:
+                self._frame_pool.put(img)
+            else:
+                self.visualize(img, None)
+            img = None
+        if img is not None:
+            if not self._pending:
+                self._batch_deadline = time.monotonic() + self._batch_max_wait
+            self._pending.append(img)
+
+        # Wait until the batch is full (or has waited long enough) before running inference.
+        if not self._pending:
+            return
+        if len(self._pending) < self._batch_size and time.monotonic() < self._batch_deadline:
+            return
+        batch, self._pending = self._pending, []
+
+        # Run YOLO inference on the whole batch in one call. Exported models have a fixed
+        # batch size, so for them a partial batch is padded by repeating its newest frame.
+        padding = []
+        if self._fixed_batch:
+            padding = [batch[-1]] * (self._batch_size - len(batch))
+        results = self.model(batch + padding, imgsz=self.config.detection.imgsz, verbose=False)
+        if len(results) != len(batch) + len(padding):
+            raise RuntimeError(
+                f"Model returned {len(results)} results for {len(batch) + len(padding)} images; "
+                f"{self.config.detection.export_format} may not support batch_size={self._batch_size}"
+            )
+        results = results[:len(batch)]
         
-        # Visualize results
-        self.visualize(img_rgb, results)
+        # Only the newest frame is shown; hand the other buffers straight back to update().
+        for img in batch[:-1]:
+            self._frame_pool.put(img)
+
+        # Visualize results for the newest frame only
+        self.visualize(batch[-1], results[-1:])
+
+    def _extract_detections(self, result):
+        # Pull boxes and class ids off the device once as NumPy arrays, so the draw loop
+        # below works on plain ints instead of indexing tensors element by element.
+        boxes = result.boxes
+        xyxy = boxes.xyxy.cpu().numpy().astype(np.int32)
+        cls = boxes.cls.cpu().numpy().astype(int)
+        return xyxy, self._names[cls]
 
     def visualize(self, img, results):
-        # results[0].boxes contains the bounding boxes
-        # results[0].boxes.xyxy is a NumPy array: [x1, y1, x2, y2]
-        img_copy = img.copy()
-        for box in results[0].boxes.xyxy:
-            x1, y1, x2, y2 = map(int, box)
-            cv2.rectangle(img_copy, (x1, y1), (x2, y2), (0, 255, 0), 2)
-
-        # Optionally, add labels
-        if results[0].boxes.cls is not None:
-            for box, cls in zip(results[0].boxes.xyxy, results[0].boxes.cls):
-                x1, y1, _, _ = map(int, box)
-                label = f"{self.model.names[int(cls)]}"
-                cv2.putText(img_copy, label, (x1, y1-10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 1)
-
-        # Show the image
-        cv2.imshow("YOLO Detection", img_copy)
-        cv2.waitKey(1)  # 1ms delay for live feed
\ No newline at end of file
+        # Takes ownership of img: inference is done with it, so boxes are drawn straight
+        # onto the frame and the buffer is recycled once displayed. results is None for
+        # frames that skipped inference.
+        if self.config.headless:
+            self._frame_pool.put(img)
+            return
+
+        if results is not None:
+            self._draw_detections(img, results[0])
+
+        # Hand the image to the display thread
+        self._show(img)
+
+    def _draw_detections(self, img, result):
+        xyxy, labels = self._extract_detections(result)
+
+        if len(xyxy):
+            # Draw every box in a single call: (N, 4, 2) corners, clockwise from top-left.
+            corners = np.stack(
+                [xyxy[:, [0, 1]], xyxy[:, [2, 1]], xyxy[:, [2, 3]], xyxy[:, [0, 3]]], axis=1
+            )
+            cv2.polylines(img, list(corners), True, BOX_COLOR, 2)
+
+        # Label anchors sit 10px above each box; computed for all boxes at once.
+        label_origins = xyxy[:, :2] - (0, 10)
+        for origin, label in zip(label_origins.tolist(), labels.tolist()):
+            cv2.putText(img, label, origin,
+                        LABEL_FONT, 0.5, BOX_COLOR, 1)
+
+    def close(self):
+        # Stop the display thread. It owns the window, so it also destroys it.
+        if self._display_thread is None:
+            return
+        self._show(None)
+        self._display_thread.join(timeout=1.0)
+
+    def _show(self, img):
+        # Replace any frame the display thread hasn't picked up yet.
+        _put_latest(self._display_queue, self._frame_pool, img)
+
+    def _display_loop(self):
+        window_open = False
+        while True:
+            img = self._display_queue.get()
+            if img is None:
+                break
+            cv2.imshow(WINDOW_NAME, img)
+            cv2.waitKey(1)  # 1ms delay for live feed
+            window_open = True
+            self._frame_pool.put(img)
+
+        if window_open:
+            cv2.destroyWindow(WINDOW_NAME)
\ No newline at end of file
@@ -7,26 +7,25 @@ from seekcamera import (
     SeekCameraFrameFormat
 )
 
+def _on_frame(_camera, camera_frame, thermal_camera):
+    # Internal SDK Async callback fired whenever a new frame is available.
+    # The SDK requires a free function, so the owning ThermalCamera is passed in as
+    # user_data. This runs once per frame, so it goes straight to the frame callback.
+    frame_callback = thermal_camera._frame_callback
+
+    #Make sure we specified a frame callback
+    if frame_callback is None:
+        return
+
+    # Call the frame callback in the FramePipeline class in pipeline.py 
+    frame_callback(camera_frame.color_argb8888)
+
 # ThermalCamera encapsulates the Seek Thermal camera functionality. 
 class ThermalCamera:
     def __init__(self, frame_callback):
         self._frame_callback = frame_callback
         self._manager = None
         self._camera = None
-    
-    def _on_frame_impl(self, camera_frame):
-        # Internal SDK Async callback fired whenever a new frame is available.
-        print("Seek SDK Frame Available")
-
-        #Make sure we specified a frame callback
-        if self._frame_callback is None:
-            return
-
-        # Access frame data safely
-        frame = camera_frame.color_argb8888
-
-        # Call the frame callback in the FramePipeline class in pipeline.py 
-        self._frame_callback(frame)
 
     def _on_event(self, camera, event_type, event_status, _user_data):
         # Internal SDK Async callback fired whenever a camera event occurs.
@@ -34,13 +33,8 @@ class ThermalCamera:
             print("Seek SDK Camera Connect Event")
             self._camera = camera
 
-            # Cannot invoke the frame callback _on_frame_impl directly here
-            # because the SDK requires the callback to be a free function.
-            # So we define a wrapper function to call the instance method.
-            def _on_frame(camera, camera_frame, _user_data):
-                self._on_frame_impl(camera_frame)
-
-            camera.register_frame_available_callback(_on_frame)
+            # Register the module-level frame callback with ourselves as user_data.
+            camera.register_frame_available_callback(_on_frame, self)
             # Start the capture session to receive frames with the specified format.
             camera.capture_session_start(SeekCameraFrameFormat.COLOR_ARGB8888)
 